@@ -1,32 +1,163 @@
 import json
+import math
 import os
-from typing import List, Dict, Optional
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import List, Dict, Optional, Tuple, Union
 from dotenv import load_dotenv
+from backend.utils.tracing import traced
 
 # Load environment variables
 load_dotenv()
 
+# Short words that carry no meaning for lexical matching
+STOPWORDS = frozenset(
+    "the and for are but not you all any can had her was one our out has his how its may who did "
+    "get use what when where which why with this that from they will would there their about into "
+    "than them then these some such does explain describe "
+    "a an as at be by do he if in is it me my no of on or so to up us we".split()
+)
+
+WORD_PATTERN = re.compile(r'\w+')
+# Query terms shorter than this (acronyms like "AI") match whole words only, not as prefixes
+PREFIX_MATCH_MIN_CHARS = 3
+
 class VectorDB:
-    """Simple vector storage using JSON file"""
+    """
+    Simple vector storage using JSON file
+    
+    Chunks are stored compactly: all chunk texts live in one shared text buffer
+    addressed by (start, end) offset arrays, metadata values shared by every chunk
+    are stored once, and only the fields that differ per chunk are kept as columns.
+    The list-of-dicts form is only built on output. A word -> chunk index for
+    lexical ranking is rebuilt from the buffer whenever chunks are loaded or added.
+    """
     
     def __init__(self):
         """Initialize storage with JSON file"""
         self.storage_file = "./pdf_storage.json"
-        self.documents = self._load_storage()
+        self._clear()
+        self._load_storage()
         self.full_text = ""  # Store complete PDF text
+        self.page_offsets: List[int] = []  # Start of each page in full_text
+        self.sections: List[Dict] = []  # Detected document structure
+        self.structure_source = "none"
+        self.document_title = ""  # Title detected from the structure, if any
+        self.sentence_starts = array('L')  # Sentence offsets in full_text
+        self.sentence_ends = array('L')
     
-    def _load_storage(self) -> List[Dict]:
+    def _clear(self):
+        """Empty the in-memory chunk store"""
+        self.text = ""
+        self.starts = array('L')
+        self.ends = array('L')
+        self.ids: List[str] = []
+        self.metadata_keys: List[str] = []
+        self.metadata: Dict = {}
+        self.chunk_fields: Dict[str, Union[array, List]] = {}
+        # Sorted words; word i's postings are posting_chunks/posting_counts[offsets[i]:offsets[i + 1]]
+        self.vocabulary: List[str] = []
+        self.posting_offsets = array('L', [0])
+        self.posting_chunks = array('L')
+        self.posting_counts = array('L')
+    
+    @traced()
+    def _load_storage(self):
         """Load documents from JSON file"""
-        if os.path.exists(self.storage_file):
-            with open(self.storage_file, 'r') as f:
-                return json.load(f)
-        return []
+        if not os.path.exists(self.storage_file):
+            return
+        with open(self.storage_file, 'r') as f:
+            data = json.load(f)
+        
+        if isinstance(data, list):
+            # Legacy format: one dict per chunk
+            self.add_documents(
+                texts=[doc["text"] for doc in data],
+                metadatas=[doc.get("metadata", {}) for doc in data],
+                ids=[doc["id"] for doc in data],
+                save=False
+            )
+            return
+        
+        self.text = data["text"]
+        self.starts = array('L', data["starts"])
+        self.ends = array('L', data["ends"])
+        self.ids = data["ids"]
+        self.metadata_keys = data["metadata_keys"]
+        self.metadata = data["metadata"]
+        self.chunk_fields = {key: self._column(values) for key, values in data["chunk_fields"].items()}
+        self._build_term_index()
     
+    @traced()
     def _save_storage(self):
         """Save documents to JSON file"""
         with open(self.storage_file, 'w') as f:
-            json.dump(self.documents, f, indent=2)
+            json.dump({
+                "text": self.text,
+                "starts": self.starts.tolist(),
+                "ends": self.ends.tolist(),
+                "ids": self.ids,
+                "metadata_keys": self.metadata_keys,
+                "metadata": self.metadata,
+                "chunk_fields": {key: list(values) for key, values in self.chunk_fields.items()}
+            }, f)
+    
+    @staticmethod
+    def _column(values: List) -> Union[array, List]:
+        """Store a per-chunk field as an int array when possible, otherwise as a list"""
+        if all(type(value) is int for value in values):
+            return array('q', values)
+        return values
+    
+    def _set_metadata(self, metadatas: List[Dict]):
+        """
+        Compact per-chunk metadata into shared values and per-chunk columns
+        
+        Args:
+            metadatas: Metadata for every stored chunk, in chunk order
+        """
+        keys = []
+        for meta in metadatas:
+            for key in meta:
+                if key not in keys:
+                    keys.append(key)
+        
+        self.metadata_keys = keys
+        self.metadata = {}
+        self.chunk_fields = {}
+        for key in keys:
+            # A missing key is stored as None and omitted again on output
+            values = [meta.get(key) for meta in metadatas]
+            if values[0] is not None and all(value == values[0] for value in values):
+                self.metadata[key] = values[0]
+            else:
+                self.chunk_fields[key] = self._column(values)
+    
+    def _chunk_text(self, index: int) -> str:
+        """Get the text of one chunk"""
+        return self.text[self.starts[index]:self.ends[index]]
+    
+    def _chunk_metadata(self, index: int) -> Dict:
+        """Build the metadata dictionary of one chunk"""
+        meta = {}
+        for key in self.metadata_keys:
+            if key in self.metadata:
+                meta[key] = self.metadata[key]
+            elif self.chunk_fields[key][index] is not None:
+                meta[key] = self.chunk_fields[key][index]
+        return meta
     
+    @property
+    def documents(self) -> List[Dict]:
+        """Stored chunks as a list of {"id", "text", "metadata"} dictionaries"""
+        return [
+            {"id": self.ids[i], "text": self._chunk_text(i), "metadata": self._chunk_metadata(i)}
+            for i in range(len(self.ids))
+        ]
+    
+    @traced()
     def reset_collection(self) -> Dict:
         """
         Clear all stored documents
@@ -34,15 +165,56 @@ class VectorDB:
         Returns:
             Status dictionary
         """
-        self.documents = []
+        self._clear()
         self._save_storage()
         return {"status": "Collection reset successfully"}
     
+    @traced()
+    def add_chunks(
+        self,
+        text: str,
+        spans: List[Tuple[int, int]],
+        metadatas: Optional[List[Dict]] = None,
+        ids: Optional[List[str]] = None,
+        save: bool = True
+    ) -> Dict:
+        """
+        Add chunks given as (start, end) offsets into a shared text
+        
+        Args:
+            text: Text buffer the chunks are sliced from
+            spans: (start, end) character offsets of each chunk in text
+            metadatas: Optional metadata for each chunk
+            ids: Optional IDs for each chunk
+            save: Whether to persist storage afterwards
+        
+        Returns:
+            Status dictionary with count
+        """
+        if ids is None:
+            ids = [f"doc_{i}" for i in range(len(spans))]
+        
+        existing = [self._chunk_metadata(i) for i in range(len(self.ids))]
+        
+        base = len(self.text) + 1 if self.text else 0
+        self.text = f"{self.text}\n{text}" if self.text else text
+        for start, end in spans:
+            self.starts.append(base + start)
+            self.ends.append(base + end)
+        self.ids.extend(ids)
+        self._set_metadata(existing + (list(metadatas) if metadatas else [{} for _ in spans]))
+        self._build_term_index()
+        
+        if save:
+            self._save_storage()
+        return {"status": "Documents added", "count": len(spans)}
+    
     def add_documents(
-        self, 
-        texts: List[str], 
-        metadatas: Optional[List[Dict]] = None, 
-        ids: Optional[List[str]] = None
+        self,
+        texts: List[str],
+        metadatas: Optional[List[Dict]] = None,
+        ids: Optional[List[str]] = None,
+        save: bool = True
     ) -> Dict:
         """
         Add documents to storage
@@ -51,57 +223,233 @@ class VectorDB:
             texts: List of text chunks
             metadatas: Optional metadata for each chunk
             ids: Optional IDs for each chunk
-            
+            save: Whether to persist storage afterwards
+        
         Returns:
             Status dictionary with count
         """
-        if ids is None:
-            ids = [f"doc_{i}" for i in range(len(texts))]
+        spans = []
+        position = 0
+        for text in texts:
+            spans.append((position, position + len(text)))
+            position += len(text) + 1
         
-        for i, text in enumerate(texts):
-            doc = {
-                "id": ids[i],
-                "text": text,
-                "metadata": metadatas[i] if metadatas else {}
-            }
-            self.documents.append(doc)
+        return self.add_chunks("\n".join(texts), spans, metadatas, ids, save)
+    
+    @traced()
+    def _build_term_index(self):
+        """Index which chunks contain each word, and how often, for lexical ranking"""
+        postings: Dict[str, array] = {}
+        for index in range(len(self.ids)):
+            for word, count in Counter(WORD_PATTERN.findall(self._chunk_text(index).lower())).items():
+                entries = postings.get(word)
+                if entries is None:
+                    entries = postings[word] = array('L')
+                entries.append(index)
+                entries.append(count)
         
-        self._save_storage()
-        return {"status": "Documents added", "count": len(texts)}
+        self.vocabulary = sorted(postings)
+        self.posting_offsets = array('L', [0])
+        self.posting_chunks = array('L')
+        self.posting_counts = array('L')
+        for word in self.vocabulary:
+            entries = postings[word]
+            self.posting_chunks.extend(entries[0::2])
+            self.posting_counts.extend(entries[1::2])
+            self.posting_offsets.append(len(self.posting_chunks))
+    
+    def set_sentence_spans(self, spans: List[Tuple[int, int]]):
+        """
+        Store sentence offsets into full_text for span-level retrieval
+        
+        Args:
+            spans: (start, end) offsets of each sentence, in order
+        """
+        self.sentence_starts = array('L', (start for start, _ in spans))
+        self.sentence_ends = array('L', (end for _, end in spans))
+    
+    @staticmethod
+    def _query_terms(query_text: str) -> List[str]:
+        """Distinct lowercase query words worth matching, tokenized like the index"""
+        terms = []
+        for term in WORD_PATTERN.findall(query_text.lower()):
+            if len(term) > 1 and term not in STOPWORDS and term not in terms:
+                terms.append(term)
+        return terms
+    
+    @staticmethod
+    def _term_pattern(term: str) -> re.Pattern:
+        """Case-insensitive pattern matching a term and words it prefixes (plurals etc.)"""
+        if len(term) < PREFIX_MATCH_MIN_CHARS:
+            return re.compile(r'\b' + re.escape(term) + r'\b', re.IGNORECASE)
+        return re.compile(r'\b' + re.escape(term) + r'\w*', re.IGNORECASE)
+    
+    def _rank_chunks(self, terms: List[str]) -> List[Tuple[float, int]]:
+        """
+        Score chunks by how often they contain the query terms, weighted by rarity
+        
+        A term matches every indexed word it prefixes (plurals etc.); those words
+        are a contiguous range of the sorted vocabulary. Short terms match only
+        the identical word.
+        
+        Args:
+            terms: Query terms
+            
+        Returns:
+            (score, chunk index) pairs for chunks with a positive score, best first
+        """
+        scores: Dict[int, float] = {}
+        for term in terms:
+            counts: Dict[int, int] = {}
+            first = bisect_left(self.vocabulary, term)
+            if len(term) < PREFIX_MATCH_MIN_CHARS:
+                last = first + (first < len(self.vocabulary) and self.vocabulary[first] == term)
+            else:
+                last = bisect_left(self.vocabulary, term + chr(0x10FFFF))
+            for word in range(first, last):
+                for posting in range(self.posting_offsets[word], self.posting_offsets[word + 1]):
+                    chunk = self.posting_chunks[posting]
+                    counts[chunk] = counts.get(chunk, 0) + self.posting_counts[posting]
+            if not counts:
+                continue
+            idf = math.log(1 + len(self.ids) / len(counts))
+            for index, count in counts.items():
+                scores[index] = scores.get(index, 0.0) + idf * count / (count + 1.2)
+        
+        return sorted(((score, index) for index, score in scores.items()), key=lambda pair: (-pair[0], pair[1]))
     
+    @traced()
     def query_documents(self, query_text: str, n_results: int = 5) -> Dict:
         """
-        Query documents using Gemini embeddings for similarity search
+        Query documents using lexical similarity search
         
         Args:
             query_text: Search query
             n_results: Number of results to return
-            
+        
         Returns:
             Query results dictionary
         """
-        if not self.documents:
+        if not self.ids:
             return {"documents": [], "metadatas": [], "distances": []}
         
-        try:
-            # Simple search - return first n documents
-            results = []
-            for doc in self.documents[:n_results]:
-                results.append(doc["text"])
+        ranked = self._rank_chunks(self._query_terms(query_text))[:n_results]
+        if ranked:
+            indices = [index for _, index in ranked]
+            distances = [round(1 / (1 + score), 4) for score, _ in ranked]
+        else:
+            # Nothing matched - return first n documents
+            indices = list(range(min(n_results, len(self.ids))))
+            distances = [1.0] * len(indices)
+        
+        return {
+            "documents": [[self._chunk_text(i) for i in indices]],
+            "metadatas": [[self._chunk_metadata(i) for i in indices]],
+            "distances": [distances]
+        }
+    
+    def page_for_offset(self, offset: int) -> int:
+        """
+        Get the 1-based page number a full_text offset falls on
+        
+        Args:
+            offset: Character offset in full_text
             
-            return {
-                "documents": [results],
-                "metadatas": [[doc.get("metadata", {}) for doc in self.documents[:n_results]]],
-                "distances": [[0.0] * len(results)]
-            }
-        except:
-            # Fallback to first n documents
-            results = [doc["text"] for doc in self.documents[:n_results]]
-            return {
-                "documents": [results],
-                "metadatas": [[doc.get("metadata", {}) for doc in self.documents[:n_results]]],
-                "distances": [[0.0] * len(results)]
-            }
+        Returns:
+            Page number, or 0 if page offsets are unknown
+        """
+        if not self.page_offsets:
+            return 0
+        return max(1, min(bisect_right(self.page_offsets, offset), len(self.page_offsets) - 1))
+    
+    @traced()
+    def query_spans(
+        self,
+        query_text: str,
+        n_chunks: int = 5,
+        n_spans: int = 4,
+        max_chars: int = 1500
+    ) -> List[Dict]:
+        """
+        Two-stage retrieval: rank chunks, then pick the best sentences inside them
+        
+        Sentences are scored by the rarity-weighted query terms they contain.
+        Selected sentences that are adjacent in the text are merged into one span.
+        
+        Args:
+            query_text: Search query
+            n_chunks: Number of candidate chunks to take sentences from
+            n_spans: Maximum number of sentences to select
+            max_chars: Character budget for all selected text
+            
+        Returns:
+            Spans in document order, each with text, start/end offsets in full_text,
+            page and chunk_id; empty if no sentence contains a query term
+        """
+        if not self.ids or not self.sentence_starts:
+            return []
+        
+        terms = self._query_terms(query_text)
+        ranked = self._rank_chunks(terms)[:n_chunks]
+        chunks = [index for _, index in ranked]
+        
+        # Sentences starting inside the candidate chunks
+        sentence_chunk: Dict[int, int] = {}
+        for chunk in chunks:
+            first = bisect_left(self.sentence_starts, self.starts[chunk])
+            last = bisect_left(self.sentence_starts, self.ends[chunk])
+            for sentence in range(first, last):
+                sentence_chunk.setdefault(sentence, chunk)
+        
+        matches: Dict[int, List[str]] = {}
+        document_frequency: Dict[str, int] = {}
+        patterns = [(term, self._term_pattern(term)) for term in terms]
+        for sentence in sentence_chunk:
+            text = self.full_text[self.sentence_starts[sentence]:self.sentence_ends[sentence]]
+            found = [term for term, pattern in patterns if pattern.search(text)]
+            if found:
+                matches[sentence] = found
+                for term in found:
+                    document_frequency[term] = document_frequency.get(term, 0) + 1
+        
+        def score(sentence: int) -> float:
+            return sum(math.log(1 + len(sentence_chunk) / document_frequency[term]) for term in matches[sentence])
+        
+        # Unrelated sentences would be cited as sources, so return nothing instead
+        candidates = sorted(matches, key=lambda sentence: (-score(sentence), sentence))
+        
+        selected = []
+        budget = max_chars
+        for sentence in candidates:
+            length = self.sentence_ends[sentence] - self.sentence_starts[sentence]
+            if length > budget and selected:
+                continue
+            selected.append(sentence)
+            budget -= length
+            if len(selected) == n_spans or budget <= 0:
+                break
+        
+        # Merge runs of adjacent sentences: [first sentence, last sentence]
+        runs: List[List[int]] = []
+        for sentence in sorted(selected):
+            if runs and runs[-1][1] == sentence - 1:
+                runs[-1][1] = sentence
+            else:
+                runs.append([sentence, sentence])
+        
+        spans = []
+        for first, last in runs:
+            start = self.sentence_starts[first]
+            end = min(self.sentence_ends[last], start + max_chars)
+            chunk = sentence_chunk[first]
+            spans.append({
+                "text": self.full_text[start:end],
+                "start": start,
+                "end": end,
+                "page": self.page_for_offset(start),
+                "chunk_id": self._chunk_metadata(chunk).get("chunk_id", chunk)
+            })
+        return spans
     
     def get_collection_count(self) -> int:
         """
@@ -110,7 +458,7 @@ class VectorDB:
         Returns:
             Document count
         """
-        return len(self.documents)
+        return len(self.ids)
 
 # Global instance
 vector_db = VectorDB()
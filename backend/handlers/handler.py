@@ -1,16 +1,68 @@
+import asyncio
+import json
 import os
+import re
+from typing import Dict, List, Optional
 from fastapi import UploadFile, HTTPException
-from groq import Groq
+from groq import AsyncGroq
 from backend.db.db import vector_db
+from backend.utils.dedup import ChunkDeduplicator
+from backend.utils.hedging import DeadlineExceeded, hedged_caller
 from backend.utils.pdf_processor import PDFProcessor
+from backend.utils.pregenerator import pregenerator
+from backend.utils.tracing import traced
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
 # Configure Groq API (free and fast!)
-groq_client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+# The async client lets a cancelled call (deadline or losing hedge) abort its HTTP request,
+# so the SDK's retries on rate limits and server errors also stop at the deadline
+groq_client = AsyncGroq(api_key=os.getenv("GROQ_API_KEY"))
 
+# Structure-based mindmaps and study plans annotate sections with short, parallel LLM calls
+MAX_ANNOTATED_SECTIONS = 12
+SECTION_EXCERPT_CHARS = 800
+READING_WORDS_PER_MINUTE = 200
+# Longest study plan that can be requested
+MAX_STUDY_PLAN_DAYS = 60
+_annotation_slots = asyncio.Semaphore(4)
+_section_notes: Dict[int, asyncio.Task] = {}  # section index -> annotation for the current document
+
+@traced()
+async def _chat_completion(endpoint: str, prompt: str, temperature: float, max_tokens: int) -> str:
+    """
+    Run a Groq chat completion
+    
+    The call's timeout comes from the request's remaining time budget, and slow
+    calls may be hedged with a second identical call.
+    
+    Args:
+        endpoint: Name used for latency and hedging stats
+        prompt: User prompt
+        temperature: Sampling temperature
+        max_tokens: Maximum tokens to generate
+        
+    Returns:
+        Generated message content
+    """
+    def make_call(timeout: float):
+        return groq_client.chat.completions.create(
+            model="llama-3.3-70b-versatile",
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout
+        )
+    
+    try:
+        response = await hedged_caller.call(endpoint, make_call)
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    return response.choices[0].message.content
+
+@traced()
 async def uploading_pdf(file: UploadFile):
     """
     Upload and process PDF file:
@@ -18,8 +70,9 @@ async def uploading_pdf(file: UploadFile):
     2. Extract text from PDF
     3. Check if PDF is empty
     4. Clear ChromaDB collection
-    5. Chunk text and create embeddings
+    5. Strip boilerplate lines, chunk text and drop near-duplicate chunks
     6. Store in ChromaDB
+    7. Start background pre-generation of common artifacts
     
     Args:
         file: Uploaded PDF file
@@ -49,7 +102,22 @@ async def uploading_pdf(file: UploadFile):
     
     # Extract text from PDF
     try:
-        extracted_text = pdf_processor.extract_text_from_pdf(pdf_bytes)
+        # Parse the PDF once for page texts, metadata and section structure
+        document = pdf_processor.extract_document(pdf_bytes)
+        pages = document["pages"]
+        metadata = document["metadata"]
+        structure = document["structure"]
+        
+        # Drop running headers, footers and page numbers before chunking
+        pages, boilerplate_lines = pdf_processor.strip_boilerplate(pages)
+        
+        # Blank out pages that nearly repeat an earlier page, keeping page numbers aligned
+        duplicate_pages = ChunkDeduplicator.find_duplicates(pages)
+        copied_pages = {}
+        for duplicate, original in duplicate_pages.items():
+            pages[duplicate] = ""
+            copied_pages.setdefault(original, []).append(duplicate + 1)
+        extracted_text = "\n".join(pages).strip()
         
         # Check if PDF is empty
         if pdf_processor.is_pdf_empty(extracted_text):
@@ -62,12 +130,13 @@ async def uploading_pdf(file: UploadFile):
         # Store full text for later use
         vector_db.full_text = extracted_text
         
-        # Get PDF metadata
-        metadata = pdf_processor.get_pdf_metadata(pdf_bytes)
-        
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
     
+    # Stop pre-generating artifacts for the document being replaced
+    pregenerator.cancel()
+    _reset_section_notes()
+    
     # Reset storage (clear previous data)
     try:
         vector_db.reset_collection()
@@ -76,7 +145,32 @@ async def uploading_pdf(file: UploadFile):
     
     # Chunk the text for better embeddings
     try:
-        chunks = pdf_processor.chunk_text(extracted_text, chunk_size=500, overlap=50)
+        # Chunks are offsets into one normalized buffer, so overlaps aren't copied
+        text_buffer, spans = pdf_processor.chunk_spans(extracted_text, chunk_size=500, overlap=50)
+        
+        # Keep the first of each group of near-duplicate chunks, remembering where the copies were
+        duplicates = ChunkDeduplicator.find_duplicates([text_buffer[start:end] for start, end in spans])
+        duplicate_spans = {}
+        for duplicate, original in duplicates.items():
+            duplicate_spans.setdefault(original, []).append(list(spans[duplicate]))
+        kept = [i for i in range(len(spans)) if i not in duplicates]
+        chunks = [spans[i] for i in kept]
+        
+        # Keep a single copy of the document text in memory
+        vector_db.full_text = text_buffer
+        vector_db.page_offsets = pdf_processor.page_offsets(pages)
+        
+        # Point the chunks covering a repeated page at the pages that copied it
+        chunk_copied_pages = {}
+        for original, copies in copied_pages.items():
+            page_start, page_end = vector_db.page_offsets[original], vector_db.page_offsets[original + 1]
+            for i, (start, end) in enumerate(chunks):
+                if start < page_end and end > page_start:
+                    chunk_copied_pages.setdefault(i, []).extend(copies)
+        vector_db.set_sentence_spans(pdf_processor.sentence_spans(text_buffer))
+        vector_db.sections = structure["sections"]
+        vector_db.structure_source = structure["source"]
+        vector_db.document_title = structure["title"] or ""
         
         # Prepare metadata for each chunk
         chunk_metadatas = [
@@ -84,9 +178,11 @@ async def uploading_pdf(file: UploadFile):
                 "filename": file.filename,
                 "chunk_id": i,
                 "total_chunks": len(chunks),
-                "num_pages": metadata.get("num_pages", 0)
+                "num_pages": metadata.get("num_pages", 0),
+                **({"duplicate_spans": duplicate_spans[original]} if original in duplicate_spans else {}),
+                **({"duplicate_pages": chunk_copied_pages[i]} if i in chunk_copied_pages else {})
             }
-            for i in range(len(chunks))
+            for i, original in enumerate(kept)
         ]
         
         # Generate IDs for chunks
@@ -97,8 +193,9 @@ async def uploading_pdf(file: UploadFile):
     
     # Store in vector database
     try:
-        vector_db.add_documents(
-            texts=chunks,
+        vector_db.add_chunks(
+            text=text_buffer,
+            spans=chunks,
             metadatas=chunk_metadatas,
             ids=chunk_ids
         )
@@ -108,6 +205,14 @@ async def uploading_pdf(file: UploadFile):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error storing documents: {str(e)}")
     
+    # Pre-generate the artifacts users usually open next, at default parameters
+    pregenerator.start({
+        "summary": _generate_summary,
+        "mindmap": _generate_mindmap,
+        "quiz:5:medium": lambda: _generate_quiz(5, "medium"),
+        "flashcards:10": lambda: _generate_flashcards(10),
+    })
+    
     # Return success response
     return {
         "status": "success",
@@ -117,54 +222,85 @@ async def uploading_pdf(file: UploadFile):
         "num_pages": metadata.get("num_pages", 0),
         "text_length": len(extracted_text),
         "num_chunks": len(chunks),
+        "duplicate_pages_removed": len(duplicate_pages),
+        "duplicate_chunks_removed": len(duplicates),
+        "boilerplate_lines_removed": boilerplate_lines,
+        "num_sections": len(structure["sections"]),
+        "structure_source": structure["source"],
         "embeddings_stored": doc_count
     }
 
+@traced()
 async def asking_query(query: str):
     """
-    Ask a question about the uploaded PDF using Gemini
+    Ask a question about the uploaded PDF using Groq
     
     Args:
         query: User's question
         
     Returns:
-        Dictionary with answer and relevant context
+        Dictionary with answer, the number of passages given to the LLM
+        (context_used), and citations (page and character range in the document
+        text) for them; "grounded" is False when no passage matched and the
+        answer is based on the document's start, which is not cited
     """
     if not vector_db.full_text:
         raise HTTPException(status_code=400, detail="No PDF uploaded yet. Please upload a PDF first.")
     
     try:
-        # Get relevant chunks from vector DB
-        results = vector_db.query_documents(query, n_results=3)
-        context_chunks = results.get("documents", [[]])[0]
-        context = "\n\n".join(context_chunks) if context_chunks else vector_db.full_text[:3000]
-        
-        # Generate answer using Groq
-        prompt = f"""Based on the following context from a PDF document, answer the question.
+        # Rank chunks, then keep only the best-matching sentences inside them
+        spans = vector_db.query_spans(query, n_chunks=5, n_spans=6, max_chars=1500)
+        if spans:
+            passages = [f"[{i + 1}] (page {span['page']}) {span['text']}" for i, span in enumerate(spans)]
+            context = "\n\n".join(passages)
+            
+            # Generate answer using Groq
+            prompt = f"""Based on the following numbered excerpts from a PDF document, answer the question.
 
-Context:
+Excerpts:
 {context}
 
 Question: {query}
 
+Please provide a clear and concise answer based only on the information in the excerpts. Cite the excerpts you used with their numbers, like [1]."""
+        else:
+            # Nothing in the document matched the question, so there is nothing to cite
+            passages = [vector_db.full_text[:3000]]
+            prompt = f"""Based on the following context from a PDF document, answer the question.
+
+Context:
+{passages[0]}
+
+Question: {query}
+
 Please provide a clear and concise answer based only on the information in the context."""
         
-        response = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=1024
-        )
+        answer = await _chat_completion("ask", prompt, temperature=0.7, max_tokens=1024)
         
         return {
             "status": "success",
             "query": query,
-            "answer": response.choices[0].message.content,
-            "context_used": len(context_chunks)
+            "answer": answer,
+            "context_used": len(passages),
+            "grounded": bool(spans),
+            "citations": [
+                {
+                    "id": i + 1,
+                    "page": span["page"],
+                    "start": span["start"],
+                    "end": span["end"],
+                    "chunk_id": span["chunk_id"],
+                    "text": span["text"]
+                }
+                for i, span in enumerate(spans)
+            ]
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
 
+@traced()
 async def searching_query(query: str):
     """
     Search for relevant sections in the PDF
@@ -201,7 +337,17 @@ async def searching_query(query: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching: {str(e)}")
 
+@traced()
 async def generating_summary():
+    """
+    Serve a pre-generated summary if available, otherwise generate one
+    
+    Returns:
+        Dictionary with summary and key points
+    """
+    return await pregenerator.serve("summary", _generate_summary)
+
+async def _generate_summary():
     """
     Generate a comprehensive summary of the uploaded PDF
     
@@ -234,22 +380,36 @@ Format your response as:
 **Overview:**
 [overview text]"""
         
-        response = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=1024
-        )
+        summary = await _chat_completion("summary", prompt, temperature=0.7, max_tokens=1024)
         
         return {
             "status": "success",
-            "summary": response.choices[0].message.content,
+            "summary": summary,
             "text_length_analyzed": len(text_to_summarize)
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating summary: {str(e)}")
 
+@traced()
 async def generating_quiz(num_questions: int = 5, difficulty: str = "medium"):
+    """
+    Serve a pre-generated quiz if available for these parameters, otherwise generate one
+    
+    Args:
+        num_questions: Number of questions to generate
+        difficulty: Difficulty level (easy, medium, hard)
+        
+    Returns:
+        Dictionary with quiz questions
+    """
+    return await pregenerator.serve(
+        f"quiz:{num_questions}:{difficulty}",
+        lambda: _generate_quiz(num_questions, difficulty)
+    )
+
+async def _generate_quiz(num_questions: int = 5, difficulty: str = "medium"):
     """
     Generate a quiz from the uploaded PDF
     
@@ -284,18 +444,9 @@ Format:
   }}
 ]"""
         
-        response = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.8,
-            max_tokens=2048
-        )
+        quiz_content = await _chat_completion("quiz", prompt, temperature=0.8, max_tokens=2048)
         
         # Parse the JSON response
-        import json
-        import re
-        quiz_content = response.choices[0].message.content
-        
         # Extract JSON from markdown code blocks if present
         json_match = re.search(r'```(?:json)?\s*(\[.*?\])\s*```', quiz_content, re.DOTALL)
         if json_match:
@@ -317,10 +468,28 @@ Format:
                 "difficulty": difficulty,
                 "quiz": quiz_content
             }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating quiz: {str(e)}")
 
+@traced()
 async def generating_flashcards(num_cards: int = 10):
+    """
+    Serve pre-generated flashcards if available for this count, otherwise generate them
+    
+    Args:
+        num_cards: Number of flashcards to generate
+        
+    Returns:
+        Dictionary with flashcards
+    """
+    return await pregenerator.serve(
+        f"flashcards:{num_cards}",
+        lambda: _generate_flashcards(num_cards)
+    )
+
+async def _generate_flashcards(num_cards: int = 10):
     """
     Generate flashcards from the uploaded PDF
     
@@ -351,18 +520,9 @@ Format:
   }}
 ]"""
         
-        response = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=2048
-        )
+        flashcards_content = await _chat_completion("flashcards", prompt, temperature=0.7, max_tokens=2048)
         
         # Parse the JSON response
-        import json
-        import re
-        flashcards_content = response.choices[0].message.content
-        
         # Extract JSON from markdown code blocks if present
         json_match = re.search(r'```(?:json)?\s*(\[.*?\])\s*```', flashcards_content, re.DOTALL)
         if json_match:
@@ -382,10 +542,223 @@ Format:
                 "num_cards": num_cards,
                 "flashcards": flashcards_content
             }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating flashcards: {str(e)}")
 
+def _reset_section_notes():
+    """Cancel and forget section annotations made for the previous document"""
+    for task in _section_notes.values():
+        task.cancel()
+    _section_notes.clear()
+
+def _parse_json_object(content: str) -> Optional[Dict]:
+    """Parse a JSON object from an LLM response, unwrapping markdown code blocks"""
+    json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', content, re.DOTALL)
+    if json_match:
+        content = json_match.group(1)
+    try:
+        data = json.loads(content)
+        return data if isinstance(data, dict) else None
+    except ValueError:
+        return None
+
+def _top_sections() -> List[int]:
+    """Indices of the sections at the shallowest level that has at least two of them"""
+    levels = sorted({section["level"] for section in vector_db.sections})
+    for level in levels:
+        top = [i for i, section in enumerate(vector_db.sections) if section["level"] == level]
+        if len(top) >= 2:
+            return top
+    return [i for i, section in enumerate(vector_db.sections) if section["level"] == levels[0]]
+
+def _section_text(section: Dict) -> str:
+    """Text of the pages a section spans"""
+    offsets = vector_db.page_offsets
+    return vector_db.full_text[offsets[section["start_page"] - 1]:offsets[section["end_page"]]]
+
+async def _annotate_section(index: int) -> Dict:
+    """
+    Ask the LLM to describe one section from an excerpt of its text
+    
+    Args:
+        index: Index into vector_db.sections
+        
+    Returns:
+        Dictionary with description and key_points
+    """
+    section = vector_db.sections[index]
+    excerpt = _section_text(section)[:SECTION_EXCERPT_CHARS]
+    
+    prompt = f"""Describe this section of a document for a student.
+
+Section title: {section["title"]}
+
+Section text (beginning):
+{excerpt}
+
+IMPORTANT: Return ONLY a valid JSON object, nothing else. No markdown, no explanations.
+
+Format:
+{{"description": "One sentence describing the section", "key_points": ["Point 1", "Point 2", "Point 3"]}}"""
+    
+    async with _annotation_slots:
+        content = await _chat_completion("section_notes", prompt, temperature=0.5, max_tokens=300)
+    
+    note = _parse_json_object(content) or {}
+    return {
+        "description": note.get("description") or content.strip()[:300],
+        "key_points": [str(point) for point in note.get("key_points", [])][:4]
+    }
+
+async def _section_notes_for(indices: List[int]) -> Dict[int, Dict]:
+    """
+    Annotate sections in parallel, reusing annotations already made for this document
+    
+    Args:
+        indices: Indices into vector_db.sections
+        
+    Returns:
+        Mapping of section index to annotation; sections that failed are left out
+    """
+    for index in indices:
+        if index not in _section_notes:
+            _section_notes[index] = asyncio.create_task(_annotate_section(index))
+    
+    results = await asyncio.gather(
+        *(asyncio.shield(_section_notes[index]) for index in indices),
+        return_exceptions=True
+    )
+    
+    notes = {}
+    for index, result in zip(indices, results):
+        if isinstance(result, BaseException):
+            # Retry on the next request instead of caching the failure
+            _section_notes.pop(index, None)
+        else:
+            notes[index] = result
+    return notes
+
+def _document_title() -> str:
+    """Title for the uploaded document, as detected or from its filename"""
+    if vector_db.document_title:
+        return vector_db.document_title
+    filename = vector_db.metadata.get("filename") or "Document"
+    return os.path.splitext(filename)[0]
+
+async def _structured_mindmap() -> Dict:
+    """
+    Build a mind map from the detected sections, with LLM-written annotations
+    for the top-level sections
+    
+    Returns:
+        Dictionary with mind map structure
+    """
+    annotated = _top_sections()[:MAX_ANNOTATED_SECTIONS]
+    notes = await _section_notes_for(annotated)
+    
+    root = {"title": _document_title(), "children": []}
+    nodes = []
+    stack = []  # (level, node) of the open ancestors
+    for index, section in enumerate(vector_db.sections):
+        node = {"title": section["title"], "pages": f"{section['start_page']}-{section['end_page']}"}
+        if index in notes:
+            node["description"] = notes[index]["description"]
+        node["children"] = []
+        
+        while stack and stack[-1][0] >= section["level"]:
+            stack.pop()
+        parent = stack[-1][1] if stack else root
+        parent["children"].append(node)
+        stack.append((section["level"], node))
+        nodes.append(node)
+    
+    # Sections without subsections show their key points instead
+    for index, note in notes.items():
+        if not nodes[index]["children"]:
+            nodes[index]["children"] = [{"title": point} for point in note["key_points"]]
+    
+    return {
+        "status": "success",
+        "mindmap": root,
+        "structure_source": vector_db.structure_source
+    }
+
+async def _structured_studyplan(duration_days: int) -> Dict:
+    """
+    Build a study plan covering every detected section, balanced across days by
+    section length, with LLM-written key points for the top-level sections
+    
+    Args:
+        duration_days: Number of days for the study plan
+        
+    Returns:
+        Dictionary with study plan
+    """
+    top = _top_sections()
+    notes = await _section_notes_for(top[:MAX_ANNOTATED_SECTIONS])
+    sizes = [len(_section_text(vector_db.sections[index]).split()) for index in top]
+    total = sum(sizes) or 1
+    
+    # Assign consecutive sections to days so each day gets a similar amount of text
+    groups = [[] for _ in range(duration_days)]
+    position = 0
+    for index, size in zip(top, sizes):
+        day = min(duration_days - 1, int((position + size / 2) * duration_days / total))
+        groups[day].append((index, size))
+        position += size
+    groups = [group for group in groups if group]
+    
+    days = []
+    for group in groups:
+        sections = [vector_db.sections[index] for index, _ in group]
+        tasks = []
+        for index, _ in group:
+            section = vector_db.sections[index]
+            tasks.append(f"Read pages {section['start_page']}-{section['end_page']}: {section['title']}")
+            tasks.extend(f"Review: {point}" for point in notes.get(index, {}).get("key_points", [])[:2])
+        
+        # Reading time doubled to allow for note-taking, rounded to half hours
+        minutes = sum(size for _, size in group) / READING_WORDS_PER_MINUTE * 2
+        hours = max(0.5, round(minutes / 30) / 2)
+        
+        days.append({
+            "day": len(days) + 1,
+            "title": " & ".join(section["title"] for section in sections[:2]) + (" ..." if len(sections) > 2 else ""),
+            "topics": [section["title"] for section in sections],
+            "tasks": tasks,
+            "duration": f"{hours:g} hours"
+        })
+    
+    # Days left over when there are fewer sections than days go to revision
+    while len(days) < duration_days:
+        days.append({
+            "day": len(days) + 1,
+            "title": "Review & Practice",
+            "topics": [vector_db.sections[index]["title"] for index in top],
+            "tasks": ["Revisit your notes on the key points", "Take a practice quiz", "Go through the flashcards"],
+            "duration": "1 hour"
+        })
+    
+    return {
+        "status": "success",
+        "duration_days": duration_days,
+        "study_plan": {"days": days},
+        "structure_source": vector_db.structure_source
+    }
+
+@traced()
 async def generating_mindmap():
+    """
+    Serve a pre-generated mind map if available, otherwise generate one
+    
+    Returns:
+        Dictionary with mind map structure
+    """
+    return await pregenerator.serve("mindmap", _generate_mindmap)
+
+async def _generate_mindmap():
     """
     Generate a mind map structure from the uploaded PDF
     
@@ -396,6 +769,9 @@ async def generating_mindmap():
         raise HTTPException(status_code=400, detail="No PDF uploaded yet. Please upload a PDF first.")
     
     try:
+        if len(vector_db.sections) >= 2:
+            return await _structured_mindmap()
+        
         text_for_mindmap = vector_db.full_text[:3500]
         
         prompt = f"""Create a hierarchical mind map structure from this document.
@@ -426,18 +802,9 @@ Format:
   ]
 }}"""
         
-        response = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=1536
-        )
+        mindmap_content = await _chat_completion("mindmap", prompt, temperature=0.7, max_tokens=1536)
         
         # Parse the JSON response
-        import json
-        import re
-        mindmap_content = response.choices[0].message.content
-        
         # Extract JSON from markdown code blocks if present
         json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', mindmap_content, re.DOTALL)
         if json_match:
@@ -455,9 +822,12 @@ Format:
                 "status": "success",
                 "mindmap": mindmap_content
             }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating mindmap: {str(e)}")
 
+@traced()
 async def generating_studyplan(duration_days: int = 7):
     """
     Generate a study plan from the uploaded PDF
@@ -471,7 +841,13 @@ async def generating_studyplan(duration_days: int = 7):
     if not vector_db.full_text:
         raise HTTPException(status_code=400, detail="No PDF uploaded yet. Please upload a PDF first.")
     
+    if not 1 <= duration_days <= MAX_STUDY_PLAN_DAYS:
+        raise HTTPException(status_code=400, detail=f"duration_days must be between 1 and {MAX_STUDY_PLAN_DAYS}")
+    
     try:
+        if len(vector_db.sections) >= 2:
+            return await _structured_studyplan(duration_days)
+        
         text_for_plan = vector_db.full_text[:3500]
         
         prompt = f"""Create a {duration_days}-day study plan for this document. Break down the content into manageable daily tasks.
@@ -494,18 +870,9 @@ Format:
   ]
 }}"""
         
-        response = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=2048
-        )
+        plan_content = await _chat_completion("studyplan", prompt, temperature=0.7, max_tokens=2048)
         
         # Parse the JSON response
-        import json
-        import re
-        plan_content = response.choices[0].message.content
-        
         # Extract JSON from markdown code blocks if present
         json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', plan_content, re.DOTALL)
         if json_match:
@@ -528,5 +895,7 @@ Format:
                 "duration_days": duration_days,
                 "study_plan": plan_content
             }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating study plan: {str(e)}")
\ No newline at end of file
@@ -1,6 +1,10 @@
-from fastapi import FastAPI
+import uuid
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from backend.routes.routes import router
+from backend.utils.hedging import REQUEST_TIMEOUT_SECONDS, deadline
+from backend.utils.pregenerator import pregenerator
+from backend.utils.tracing import trace_request
 
 
 app = FastAPI()
@@ -14,5 +18,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Background pre-generation yields while interactive requests are running
+@app.middleware("http")
+async def mark_interactive(request: Request, call_next):
+    async with pregenerator.interactive():
+        return await call_next(request)
+
+# Give each request a time budget; clients may ask for a shorter one
+@app.middleware("http")
+async def apply_deadline(request: Request, call_next):
+    timeout = REQUEST_TIMEOUT_SECONDS
+    try:
+        timeout = min(timeout, float(request.headers.get("X-Request-Timeout", timeout)))
+    except ValueError:
+        pass
+    with deadline(timeout):
+        return await call_next(request)
+
+# Trace every request and log the span tree of slow ones
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    with trace_request(f"{request.method} {request.url.path}", request_id):
+        response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
 app.include_router(router)
 
@@ -1,5 +1,9 @@
-from fastapi import APIRouter, UploadFile, File
-from pydantic import BaseModel
+import asyncio
+import hmac
+import os
+from fastapi import APIRouter, UploadFile, File, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
 from typing import Optional
 from backend.handlers.handler import (
     uploading_pdf,
@@ -10,7 +14,11 @@ from backend.handlers.handler import (
     generating_flashcards,
     generating_mindmap,
     generating_studyplan,
+    MAX_STUDY_PLAN_DAYS,
 )
+from backend.utils.hedging import hedged_caller
+from backend.utils.pregenerator import pregenerator
+from backend.utils.tracing import sample_stacks
 
 router = APIRouter()
 
@@ -26,7 +34,7 @@ class FlashcardRequest(BaseModel):
     num_cards: Optional[int] = 10
 
 class StudyPlanRequest(BaseModel):
-    duration_days: Optional[int] = 7
+    duration_days: int = Field(7, ge=1, le=MAX_STUDY_PLAN_DAYS)
 
 # Routes
 @router.post("/pdf/upload")
@@ -61,3 +69,19 @@ async def generate_mindmap():
 async def generate_studyplan(request: StudyPlanRequest):
     return await generating_studyplan(request.duration_days)
 
+@router.get("/stats")
+async def get_stats():
+    return {
+        "pregeneration": pregenerator.get_stats(),
+        "llm": hedged_caller.get_stats()
+    }
+
+@router.get("/debug/profile", response_class=PlainTextResponse)
+async def debug_profile(seconds: float = 5.0, x_debug_token: Optional[str] = Header(None)):
+    # Disabled unless DEBUG_PROFILE_TOKEN is set; callers must send it as X-Debug-Token
+    token = os.getenv("DEBUG_PROFILE_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(x_debug_token or "", token):
+        raise HTTPException(status_code=403, detail="Invalid debug token")
+    return await asyncio.to_thread(sample_stacks, seconds)
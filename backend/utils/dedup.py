@@ -0,0 +1,109 @@
+import hashlib
+from typing import Dict, List, Optional
+from backend.utils.tracing import traced
+
+# MinHash signature: one-permutation hashing of word shingles into bins
+SHINGLE_WORDS = 5
+NUM_BINS = 64
+# LSH banding: 16 bands of 4 bins catch pairs above roughly 0.5 similarity
+BAND_ROWS = 4
+# Estimated Jaccard similarity at which a chunk counts as a near-duplicate
+NEAR_DUPLICATE_THRESHOLD = 0.8
+
+_BIN_BITS = NUM_BINS.bit_length() - 1
+_BIN_MASK = NUM_BINS - 1
+
+
+class ChunkDeduplicator:
+    """Utility class for finding near-duplicate text chunks with MinHash/LSH"""
+    
+    @staticmethod
+    def signature(text: str) -> List[Optional[int]]:
+        """
+        Compute a MinHash signature over word shingles
+        
+        Each shingle is hashed once and assigned to a bin by its low bits; a bin
+        keeps the minimum of the remaining bits. Empty bins are None.
+        
+        Args:
+            text: Chunk text
+        
+        Returns:
+            List of NUM_BINS minimum hash values
+        """
+        words = text.lower().split()
+        signature: List[Optional[int]] = [None] * NUM_BINS
+        for i in range(max(1, len(words) - SHINGLE_WORDS + 1)):
+            shingle = " ".join(words[i:i + SHINGLE_WORDS]).encode()
+            value = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), "little")
+            bin_index = value & _BIN_MASK
+            value >>= _BIN_BITS
+            current = signature[bin_index]
+            if current is None or value < current:
+                signature[bin_index] = value
+        return signature
+    
+    @staticmethod
+    def similarity(a: List[Optional[int]], b: List[Optional[int]]) -> float:
+        """
+        Estimate Jaccard similarity from two signatures
+        
+        Args:
+            a: First signature
+            b: Second signature
+        
+        Returns:
+            Estimated similarity between 0 and 1
+        """
+        compared = matches = 0
+        for x, y in zip(a, b):
+            if x is None and y is None:
+                continue
+            compared += 1
+            matches += x == y
+        return matches / compared if compared else 1.0
+    
+    @staticmethod
+    @traced()
+    def find_duplicates(texts: List[str]) -> Dict[int, int]:
+        """
+        Find texts (chunks or pages) that nearly duplicate an earlier one
+        
+        Args:
+            texts: Texts in document order
+        
+        Returns:
+            Mapping of duplicate index to the index of the earlier text it repeats
+        """
+        signatures = [ChunkDeduplicator.signature(text) for text in texts]
+        buckets: Dict[tuple, List[int]] = {}
+        duplicates: Dict[int, int] = {}
+        
+        for index, signature in enumerate(signatures):
+            candidates = set()
+            keys = []
+            for band in range(0, NUM_BINS, BAND_ROWS):
+                rows = tuple(signature[band:band + BAND_ROWS])
+                # Bands with empty bins would collide between unrelated short chunks
+                if None in rows:
+                    continue
+                key = (band, rows)
+                keys.append(key)
+                candidates.update(buckets.get(key, []))
+            
+            original = min(
+                (
+                    candidate for candidate in candidates
+                    if ChunkDeduplicator.similarity(signature, signatures[candidate]) >= NEAR_DUPLICATE_THRESHOLD
+                ),
+                default=None
+            )
+            if original is not None:
+                duplicates[index] = original
+                continue
+            
+            # Only kept chunks are indexed, so duplicates always point at a kept chunk
+            for key in keys:
+                buckets.setdefault(key, []).append(index)
+        
+        return duplicates
@@ -0,0 +1,190 @@
+import asyncio
+import contextvars
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Deque, Dict, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Time budget for a whole request, and for LLM calls made outside any request
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("REQUEST_TIMEOUT_SECONDS", "60"))
+# Share of calls per endpoint allowed to send a hedge (0 disables hedging)
+HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", "0.1"))
+# Latency samples kept per endpoint, and how many are needed before hedging
+LATENCY_WINDOW = 200
+MIN_SAMPLES_TO_HEDGE = 20
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's time budget runs out"""
+
+
+@contextmanager
+def deadline(seconds: float) -> Iterator[None]:
+    """
+    Give the code inside a time budget, never extending an enclosing one
+    
+    Args:
+        seconds: Budget in seconds from now
+    """
+    current = _deadline.get()
+    new = time.monotonic() + seconds
+    token = _deadline.set(new if current is None else min(current, new))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> float:
+    """
+    Get the time left in the current budget
+    
+    Returns:
+        Seconds left (REQUEST_TIMEOUT_SECONDS outside any deadline)
+    """
+    current = _deadline.get()
+    if current is None:
+        return REQUEST_TIMEOUT_SECONDS
+    return current - time.monotonic()
+
+
+class _EndpointStats:
+    """Latency window and hedging counters for one endpoint"""
+    
+    __slots__ = ("latencies", "calls", "hedges", "hedge_wins", "timeouts")
+    
+    def __init__(self):
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+    
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Latency at the given fraction of the window, or None without samples"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class HedgedCaller:
+    """Runs calls within the request deadline, hedging ones slower than the endpoint's p95"""
+    
+    def __init__(self):
+        """Initialize empty per-endpoint stats"""
+        self._stats: Dict[str, _EndpointStats] = {}
+    
+    def _hedge_delay(self, stats: _EndpointStats) -> Optional[float]:
+        """Delay after which to hedge, or None if hedging isn't allowed for this call"""
+        if HEDGE_MAX_RATE <= 0 or len(stats.latencies) < MIN_SAMPLES_TO_HEDGE:
+            return None
+        if stats.hedges >= stats.calls * HEDGE_MAX_RATE:
+            return None
+        return stats.percentile(0.95)
+    
+    async def call(self, endpoint: str, make_call: Callable[[float], Awaitable[T]]) -> T:
+        """
+        Run a call with a timeout from the remaining budget, hedging it if slow
+        
+        When the call outlives the endpoint's running p95 and the hedge budget allows,
+        an identical second call is started; the first to succeed wins and the other
+        is cancelled.
+        
+        Args:
+            endpoint: Name used for latency and hedging stats
+            make_call: Factory taking a timeout in seconds and returning the call
+        
+        Returns:
+            Result of the winning call
+        
+        Raises:
+            DeadlineExceeded: If the budget runs out before any call succeeds
+        """
+        stats = self._stats.setdefault(endpoint, _EndpointStats())
+        budget = remaining()
+        if budget <= 0:
+            stats.timeouts += 1
+            raise DeadlineExceeded(f"No time left for {endpoint}")
+        
+        stats.calls += 1
+        tasks = set()
+        
+        def launch() -> asyncio.Task:
+            task = asyncio.create_task(make_call(remaining()))
+            tasks.add(task)
+            return task
+        
+        # Latency is what the caller waited, from the primary's start, so hedge
+        # wins and timeouts don't bias the window low
+        started = time.monotonic()
+        primary = launch()
+        try:
+            delay = self._hedge_delay(stats)
+            if delay is not None and delay < budget:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    stats.hedges += 1
+                    launch()
+            
+            error: Optional[BaseException] = None
+            while tasks:
+                done, _ = await asyncio.wait(
+                    tasks, timeout=max(remaining(), 0), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in done:
+                    tasks.discard(task)
+                    if task.exception() is not None:
+                        # Wait for the other call before giving up
+                        error = task.exception()
+                        continue
+                    stats.latencies.append(time.monotonic() - started)
+                    if task is not primary:
+                        stats.hedge_wins += 1
+                    return task.result()
+            
+            if not tasks and error is not None:
+                raise error
+            stats.timeouts += 1
+            stats.latencies.append(time.monotonic() - started)
+            raise DeadlineExceeded(f"{endpoint} did not finish within the request deadline")
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    def get_stats(self) -> Dict:
+        """
+        Get latency and hedging stats per endpoint
+        
+        Returns:
+            Stats dictionary
+        """
+        endpoints = {}
+        for endpoint, stats in self._stats.items():
+            p50 = stats.percentile(0.5)
+            p95 = stats.percentile(0.95)
+            endpoints[endpoint] = {
+                "calls": stats.calls,
+                "hedges": stats.hedges,
+                "hedge_rate": round(stats.hedges / stats.calls, 3) if stats.calls else None,
+                "hedge_wins": stats.hedge_wins,
+                "timeouts": stats.timeouts,
+                "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            }
+        return {
+            "request_timeout_seconds": REQUEST_TIMEOUT_SECONDS,
+            "hedge_max_rate": HEDGE_MAX_RATE,
+            "endpoints": endpoints,
+        }
+
+
+# Global instance
+hedged_caller = HedgedCaller()
@@ -1,35 +1,140 @@
+import re
 import PyPDF2
 from io import BytesIO
-from typing import List, Dict
+from typing import List, Dict, Tuple
+from backend.utils.tracing import traced
+
+# Line length bounds for detected headings
+HEADING_MIN_CHARS = 3
+HEADING_MAX_CHARS = 80
+
+# A line near a page edge is boilerplate when it repeats on this many pages
+BOILERPLATE_EDGE_LINES = 3
+BOILERPLATE_MIN_PAGES = 3
+BOILERPLATE_MIN_PAGE_FRACTION = 0.2
+
+PAGE_NUMBER_PATTERN = re.compile(r'^\W*(page\s*)?\d+(\s*(of|/)\s*\d+)?\W*$', re.IGNORECASE)
+# A running header or footer carrying a page number, e.g. "Guide - Page 4" or "12 | Guide"
+FOOTER_NUMBER_PATTERN = re.compile(r'\bpage\s*\d+|^\d+\s*[|\u00b7\u2022\-\u2013\u2014]\s|\s[|\u00b7\u2022\-\u2013\u2014]\s*\d+$', re.IGNORECASE)
+# Sentence boundary: end punctuation, optional closing quote/bracket, then a space and a capital or digit
+SENTENCE_END_PATTERN = re.compile(r'[.!?]["\')\]]?(?= ["\'(\[]?[A-Z0-9])')
+MAX_SENTENCE_WORDS = 60
+
+CHAPTER_PATTERN = re.compile(r'^(chapter|part|unit|module|lesson)\s+([0-9]+|[ivxlc]+)\b', re.IGNORECASE)
+NUMBERED_HEADING_PATTERN = re.compile(r'^(\d{1,2}(?:\.\d{1,2}){0,2})\.?\s+[A-Z][^.!?]*$')
 
 class PDFProcessor:
     """Utility class for PDF processing operations"""
     
     @staticmethod
-    def extract_text_from_pdf(pdf_bytes: bytes) -> str:
+    @traced()
+    def extract_pages(pdf_bytes: bytes) -> List[str]:
         """
-        Extract text from PDF bytes
+        Extract text from PDF bytes, one string per page
         
         Args:
             pdf_bytes: PDF file content as bytes
             
         Returns:
-            Extracted text as string
+            List of page texts
         """
         try:
             pdf_file = BytesIO(pdf_bytes)
             pdf_reader = PyPDF2.PdfReader(pdf_file)
             
-            text = ""
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text()
-            
-            return text.strip()
+            return [page.extract_text() or "" for page in pdf_reader.pages]
         
         except Exception as e:
             raise Exception(f"Error extracting text from PDF: {str(e)}")
     
+    @staticmethod
+    def extract_text_from_pdf(pdf_bytes: bytes) -> str:
+        """
+        Extract text from PDF bytes
+        
+        Args:
+            pdf_bytes: PDF file content as bytes
+            
+        Returns:
+            Extracted text as string
+        """
+        return "\n".join(PDFProcessor.extract_pages(pdf_bytes)).strip()
+    
+    @staticmethod
+    @traced()
+    def strip_boilerplate(pages: List[str]) -> Tuple[List[str], int]:
+        """
+        Remove running headers, footers, page numbers and other lines repeated across pages
+        
+        Only lines near the top or bottom of a page are considered. A line counts as
+        repeated when it appears at the same edge on enough pages. Digits are
+        ignored only in lines that are mostly numeric or carry a page number, so
+        numbered headings such as "Chapter 3" are kept.
+        
+        Args:
+            pages: List of page texts
+            
+        Returns:
+            Tuple of (cleaned page texts, number of lines removed)
+        """
+        def key(line: str) -> str:
+            line = ' '.join(line.lower().split())
+            digits = sum(c.isdigit() for c in line)
+            if digits * 2 >= sum(c.isalnum() for c in line) or FOOTER_NUMBER_PATTERN.search(line):
+                return re.sub(r'\d+', '#', line)
+            return line
+        
+        def edge_lines(lines: List[str]) -> List[Tuple[str, int]]:
+            indices = [i for i, line in enumerate(lines) if line.strip()]
+            return (
+                [("top", i) for i in indices[:BOILERPLATE_EDGE_LINES]]
+                + [("bottom", i) for i in indices[-BOILERPLATE_EDGE_LINES:]]
+            )
+        
+        page_lines = [page.split("\n") for page in pages]
+        
+        pages_per_key = {}
+        for lines in page_lines:
+            for line_key in {(edge, key(lines[i])) for edge, i in edge_lines(lines)}:
+                pages_per_key[line_key] = pages_per_key.get(line_key, 0) + 1
+        
+        min_pages = max(BOILERPLATE_MIN_PAGES, int(len(pages) * BOILERPLATE_MIN_PAGE_FRACTION))
+        repeated = {line_key for line_key, count in pages_per_key.items() if count >= min_pages}
+        
+        cleaned = []
+        removed = 0
+        for lines in page_lines:
+            drop = {
+                i for edge, i in edge_lines(lines)
+                if (edge, key(lines[i])) in repeated or PAGE_NUMBER_PATTERN.match(lines[i])
+            }
+            removed += len(drop)
+            cleaned.append("\n".join(line for i, line in enumerate(lines) if i not in drop))
+        
+        return cleaned, removed
+    
+    @staticmethod
+    def page_offsets(pages: List[str]) -> List[int]:
+        """
+        Compute where each page starts in the whitespace-normalized text buffer
+        
+        Matches the buffer returned by chunk_spans for "\n".join(pages).
+        
+        Args:
+            pages: List of page texts
+            
+        Returns:
+            Start offset of each page, followed by the buffer length
+        """
+        offsets = []
+        position = 0
+        for page in pages:
+            offsets.append(position)
+            position += sum(len(word) + 1 for word in page.split())
+        # Empty trailing pages start at the end of the buffer, not past it
+        length = max(position - 1, 0)
+        return [min(offset, length) for offset in offsets] + [length]
+    
     @staticmethod
     def chunk_text(text: str, chunk_size: int = 500, overlap: int = 50) -> List[str]:
         """
@@ -43,15 +148,85 @@ class PDFProcessor:
         Returns:
             List of text chunks
         """
+        buffer, spans = PDFProcessor.chunk_spans(text, chunk_size, overlap)
+        return [buffer[start:end] for start, end in spans]
+    
+    @staticmethod
+    @traced()
+    def chunk_spans(text: str, chunk_size: int = 500, overlap: int = 50) -> Tuple[str, List[Tuple[int, int]]]:
+        """
+        Split text into overlapping chunks given as character offsets into one buffer
+        
+        Overlapping words are shared in the buffer instead of being copied per chunk.
+        
+        Args:
+            text: Input text to chunk
+            chunk_size: Number of words per chunk
+            overlap: Number of overlapping words between chunks
+            
+        Returns:
+            Tuple of (whitespace-normalized text buffer, list of (start, end) offsets)
+        """
         words = text.split()
-        chunks = []
+        buffer = ' '.join(words)
+        
+        # Character offset where each word starts in the buffer
+        word_starts = []
+        position = 0
+        for word in words:
+            word_starts.append(position)
+            position += len(word) + 1
         
+        spans = []
         for i in range(0, len(words), chunk_size - overlap):
-            chunk = ' '.join(words[i:i + chunk_size])
-            if chunk:
-                chunks.append(chunk)
+            last = min(i + chunk_size, len(words)) - 1
+            spans.append((word_starts[i], word_starts[last] + len(words[last])))
         
-        return chunks
+        return buffer, spans
+    
+    @staticmethod
+    @traced()
+    def sentence_spans(buffer: str) -> List[Tuple[int, int]]:
+        """
+        Split a normalized text buffer into sentence offsets
+        
+        Runs of text without sentence punctuation (tables, lists, headings) are
+        cut into pieces of at most MAX_SENTENCE_WORDS words.
+        
+        Args:
+            buffer: Whitespace-normalized text, as returned by chunk_spans
+            
+        Returns:
+            List of (start, end) offsets in buffer
+        """
+        spans = []
+        start = 0
+        for match in SENTENCE_END_PATTERN.finditer(buffer):
+            end = match.end()
+            PDFProcessor._split_long_sentence(buffer, start, end, spans)
+            start = end + 1
+        if start < len(buffer):
+            PDFProcessor._split_long_sentence(buffer, start, len(buffer), spans)
+        return spans
+    
+    @staticmethod
+    def _split_long_sentence(buffer: str, start: int, end: int, spans: List[Tuple[int, int]]):
+        """Append (start, end) to spans, cut at word boundaries if it is too long"""
+        words = 0
+        piece_start = start
+        position = start
+        while True:
+            space = buffer.find(' ', position, end)
+            if space == -1:
+                break
+            words += 1
+            if words == MAX_SENTENCE_WORDS:
+                spans.append((piece_start, space))
+                piece_start = space + 1
+                words = 0
+            position = space + 1
+        if piece_start < end:
+            spans.append((piece_start, end))
     
     @staticmethod
     def is_pdf_empty(text: str) -> bool:
@@ -67,6 +242,7 @@ class PDFProcessor:
         return not text or text.strip() == ""
     
     @staticmethod
+    @traced()
     def get_pdf_metadata(pdf_bytes: bytes) -> Dict:
         """
         Extract metadata from PDF
@@ -87,3 +263,232 @@ class PDFProcessor:
             }
         except Exception as e:
             return {"error": str(e)}
+    
+    @staticmethod
+    @traced()
+    def extract_document(pdf_bytes: bytes) -> Dict:
+        """
+        Extract page texts, metadata and section structure in a single pass
+        
+        The PDF is parsed once and each page's text is extracted once; the same
+        extraction reports font sizes used for heading detection.
+        
+        Args:
+            pdf_bytes: PDF file content as bytes
+            
+        Returns:
+            Dictionary with "pages" (list of page texts), "metadata" (as returned by
+            get_pdf_metadata) and "structure" (see _extract_structure)
+        """
+        try:
+            pdf_file = BytesIO(pdf_bytes)
+            pdf_reader = PyPDF2.PdfReader(pdf_file)
+            
+            pages = []
+            lines = []  # (text, font size, page)
+            for page_num, page in enumerate(pdf_reader.pages):
+                text, page_lines = PDFProcessor._extract_page(page)
+                pages.append(text)
+                lines.extend((line, size, page_num) for line, size in page_lines)
+        
+        except Exception as e:
+            raise Exception(f"Error extracting text from PDF: {str(e)}")
+        
+        try:
+            metadata = {
+                "num_pages": len(pages),
+                "metadata": pdf_reader.metadata if pdf_reader.metadata else {}
+            }
+        except Exception as e:
+            metadata = {"num_pages": len(pages), "error": str(e)}
+        
+        return {
+            "pages": pages,
+            "metadata": metadata,
+            "structure": PDFProcessor._extract_structure(pdf_reader, lines)
+        }
+    
+    @staticmethod
+    def _extract_page(page: PyPDF2.PageObject) -> Tuple[str, List[Tuple[str, float]]]:
+        """
+        Extract a page's text along with its lines and their largest font size
+        
+        Args:
+            page: PDF page
+            
+        Returns:
+            Tuple of (page text, list of (normalized line, font size))
+        """
+        runs = []
+        
+        def visitor(text, cm, tm, font_dict, font_size):
+            # Text matrices often scale a unit font size to the rendered size
+            scale = abs(tm[3] * cm[3]) or 1
+            runs.append((text, font_size * scale))
+        
+        try:
+            text = page.extract_text(visitor_text=visitor) or ""
+        except Exception:
+            text = page.extract_text() or ""
+            runs = [(text, 0)]
+        
+        lines = []
+        current, size = "", 0.0
+        for run_text, run_size in runs:
+            parts = run_text.split("\n")
+            for j, part in enumerate(parts):
+                if part.strip():
+                    current += part
+                    size = max(size, run_size)
+                if j < len(parts) - 1:
+                    lines.append((" ".join(current.split()), size))
+                    current, size = "", 0.0
+        lines.append((" ".join(current.split()), size))
+        
+        return text, [line for line in lines if line[0]]
+    
+    @staticmethod
+    @traced()
+    def _extract_structure(pdf_reader: PyPDF2.PdfReader, lines: List[Tuple[str, float, int]]) -> Dict:
+        """
+        Extract the document's section structure without calling the LLM
+        
+        Uses the PDF outline (bookmarks) when present, otherwise detects headings
+        from font sizes, falling back to numbering patterns such as "2.1 Title".
+        
+        Args:
+            pdf_reader: Open PDF reader
+            lines: Text lines as (text, font size, 0-based page) in document order
+            
+        Returns:
+            Dictionary with "source" ("outline", "headings" or "none"), "title" (the
+            document title if one was detected, else None) and "sections", each with
+            title, level and 1-based start_page/end_page
+        """
+        try:
+            num_pages = len(pdf_reader.pages)
+            
+            source = "outline"
+            headings = PDFProcessor._outline_headings(pdf_reader)
+            if not headings:
+                source = "headings"
+                headings = PDFProcessor._detect_headings(lines)
+        except Exception:
+            return {"source": "none", "title": None, "sections": []}
+        
+        if not headings:
+            return {"source": "none", "title": None, "sections": []}
+        
+        # A lone first heading above all others (a cover title or a single root
+        # bookmark) names the document; its subsections become the top level
+        document_title = None
+        top_level = min(level for _, level, _ in headings)
+        if len(headings) > 1 and headings[0][1] == top_level and all(level > top_level for _, level, _ in headings[1:]):
+            document_title = headings[0][0]
+            shift = min(level for _, level, _ in headings[1:]) - 1
+            headings = [(title, level - shift, start) for title, level, start in headings[1:]]
+        
+        # A section runs until the next section at the same or a higher level
+        sections = []
+        for i, (title, level, start) in enumerate(headings):
+            end = num_pages - 1
+            for next_title, next_level, next_start in headings[i + 1:]:
+                if next_level <= level:
+                    end = max(start, next_start - 1)
+                    break
+            sections.append({
+                "title": title,
+                "level": level,
+                "start_page": start + 1,
+                "end_page": end + 1
+            })
+        
+        return {"source": source, "title": document_title, "sections": sections}
+    
+    @staticmethod
+    def _outline_headings(pdf_reader: PyPDF2.PdfReader) -> List[Tuple[str, int, int]]:
+        """
+        Flatten the PDF outline into (title, level, 0-based page) tuples
+        
+        Args:
+            pdf_reader: Open PDF reader
+            
+        Returns:
+            Headings in document order
+        """
+        headings = []
+        
+        def walk(items, level):
+            for item in items:
+                if isinstance(item, list):
+                    walk(item, level + 1)
+                    continue
+                try:
+                    page = pdf_reader.get_destination_page_number(item)
+                except Exception:
+                    continue
+                title = " ".join(str(item.title).split())
+                if title and page is not None and page >= 0:
+                    headings.append((title, level, page))
+        
+        walk(pdf_reader.outline or [], 1)
+        headings.sort(key=lambda heading: heading[2])
+        return headings
+    
+    @staticmethod
+    def _detect_headings(lines: List[Tuple[str, float, int]]) -> List[Tuple[str, int, int]]:
+        """
+        Detect headings from font sizes, or numbering patterns if sizes don't help
+        
+        Args:
+            lines: Text lines as (text, font size, 0-based page) in document order
+            
+        Returns:
+            Headings as (title, level, 0-based page) tuples in document order
+        """
+        headings = PDFProcessor._headings_by_font_size(lines)
+        if len(headings) < 2:
+            headings = PDFProcessor._headings_by_numbering(lines)
+        
+        # Titles repeated on many pages are running headers, not sections
+        pages_per_title = {}
+        for title, _, page in headings:
+            pages_per_title.setdefault(title, set()).add(page)
+        return [heading for heading in headings if len(pages_per_title[heading[0]]) <= 2]
+    
+    @staticmethod
+    def _headings_by_font_size(lines: List[Tuple[str, float, int]]) -> List[Tuple[str, int, int]]:
+        """Treat short lines set noticeably larger than body text as headings"""
+        sizes = {}
+        for text, size, _ in lines:
+            sizes[round(size, 1)] = sizes.get(round(size, 1), 0) + len(text)
+        if not sizes:
+            return []
+        body_size = max(sizes, key=sizes.get)
+        if body_size <= 0:
+            return []
+        
+        candidates = [
+            (text, round(size, 1), page) for text, size, page in lines
+            if size >= body_size * 1.15 and HEADING_MIN_CHARS <= len(text) <= HEADING_MAX_CHARS
+            and any(c.isalpha() for c in text) and not text.endswith((".", ","))
+        ]
+        
+        # The largest heading sizes become levels 1, 2 and 3
+        levels = sorted({size for _, size, _ in candidates}, reverse=True)[:3]
+        return [(text, levels.index(size) + 1, page) for text, size, page in candidates if size in levels]
+    
+    @staticmethod
+    def _headings_by_numbering(lines: List[Tuple[str, float, int]]) -> List[Tuple[str, int, int]]:
+        """Treat lines like "Chapter 3 ..." or "2.1 Title" as headings"""
+        headings = []
+        for text, _, page in lines:
+            if not HEADING_MIN_CHARS <= len(text) <= HEADING_MAX_CHARS or text.endswith((".", ",")):
+                continue
+            if CHAPTER_PATTERN.match(text):
+                headings.append((text, 1, page))
+                continue
+            match = NUMBERED_HEADING_PATTERN.match(text)
+            if match:
+                headings.append((text, match.group(1).count(".") + 1, page))
+        return headings
@@ -0,0 +1,171 @@
+import asyncio
+import contextvars
+import os
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Optional, Set
+from backend.utils.hedging import REQUEST_TIMEOUT_SECONDS, deadline, remaining
+from backend.utils.tracing import trace_request
+
+# Artifacts generated ahead of time after an upload (comma separated, empty disables)
+DEFAULT_ARTIFACTS = "summary,mindmap,quiz,flashcards"
+
+
+class PreGenerator:
+    """Speculatively generates common artifacts in the background after an upload"""
+
+    def __init__(self):
+        """Initialize empty result cache and hit-rate counters"""
+        artifacts = os.getenv("PREGENERATE_ARTIFACTS", DEFAULT_ARTIFACTS)
+        self.artifacts = [a.strip() for a in artifacts.split(",") if a.strip()]
+        self.results: Dict[str, Dict] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._claimed: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._active_requests = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.stats = {
+            artifact: {"generated": 0, "failed": 0, "hits": 0, "misses": 0, "discarded": 0}
+            for artifact in self.artifacts
+        }
+
+    def start(self, jobs: Dict[str, Callable[[], Awaitable[Dict]]]):
+        """
+        Cancel any previous run and start pre-generating the enabled artifacts
+
+        Args:
+            jobs: Mapping of cache key to a coroutine factory producing the response.
+                  The artifact name is the part of the key before the first ':'.
+        """
+        self.cancel()
+        enabled = {
+            key: job for key, job in jobs.items()
+            if key.split(":", 1)[0] in self.artifacts
+        }
+        if enabled:
+            # Run detached from the uploading request's trace
+            self._task = asyncio.create_task(self._run(enabled), context=contextvars.Context())
+
+    def cancel(self):
+        """Cancel pending pre-generation and drop results for the previous document"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        self._task = None
+        for task in self._inflight.values():
+            task.cancel()
+        self._inflight = {}
+        self._claimed = set()
+        for key in self.results:
+            self._count(key, "discarded")
+        self.results = {}
+
+    async def _run(self, jobs: Dict[str, Callable[[], Awaitable[Dict]]]):
+        """Generate artifacts one at a time, only while no interactive request is running"""
+        for key, job in jobs.items():
+            await self._idle.wait()
+            task = asyncio.create_task(self._traced_job(key, job))
+            self._inflight[key] = task
+            try:
+                result = await asyncio.shield(task)
+                self._count(key, "generated")
+                # An interactive request that joined this job already consumed it
+                if key in self._claimed:
+                    self._claimed.discard(key)
+                else:
+                    self.results[key] = result
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            except Exception:
+                self._count(key, "failed")
+            finally:
+                self._inflight.pop(key, None)
+
+    @staticmethod
+    async def _traced_job(key: str, job: Callable[[], Awaitable[Dict]]) -> Dict:
+        """Run one pre-generation job as its own traced request, with a request's time budget"""
+        with trace_request(f"pregenerate {key}"), deadline(REQUEST_TIMEOUT_SECONDS):
+            return await job()
+
+    async def serve(self, key: str, generate: Callable[[], Awaitable[Dict]]) -> Dict:
+        """
+        Return a pre-generated result for key, or generate it on demand
+
+        A pre-generated result is served once; later calls generate a fresh one.
+        Joining a job that is still running waits at most for the request's
+        remaining time budget.
+
+        Args:
+            key: Cache key, e.g. "summary" or "quiz:5:medium"
+            generate: Coroutine factory used on a miss
+
+        Returns:
+            Response dictionary
+        """
+        if key in self.results:
+            self._count(key, "hits")
+            return self.results.pop(key)
+
+        task = self._inflight.get(key)
+        if task is not None and key not in self._claimed:
+            self._claimed.add(key)
+            try:
+                result = await asyncio.wait_for(asyncio.shield(task), timeout=max(remaining(), 0))
+                self._count(key, "hits")
+                return result
+            except asyncio.TimeoutError:
+                # Leave the result to the cache; on-demand generation enforces the deadline
+                self._claimed.discard(key)
+            except asyncio.CancelledError:
+                # Only fall back when the job was cancelled, not this request
+                self._claimed.discard(key)
+                if not task.cancelled():
+                    raise
+            except Exception:
+                self._claimed.discard(key)
+
+        self._count(key, "misses")
+        return await generate()
+
+    @asynccontextmanager
+    async def interactive(self):
+        """Mark an interactive request as running so background work yields to it"""
+        self._active_requests += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._active_requests -= 1
+            if self._active_requests == 0:
+                self._idle.set()
+
+    def _count(self, key: str, field: str):
+        """Increment a counter for the artifact a cache key belongs to"""
+        artifact = key.split(":", 1)[0]
+        if artifact in self.stats:
+            self.stats[artifact][field] += 1
+
+    def get_stats(self) -> Dict:
+        """
+        Get pre-generation counters and hit rate per artifact
+
+        Returns:
+            Stats dictionary
+        """
+        artifacts = {}
+        for artifact, counts in self.stats.items():
+            served = counts["hits"] + counts["misses"]
+            artifacts[artifact] = {
+                **counts,
+                "hit_rate": round(counts["hits"] / served, 3) if served else None,
+            }
+        return {
+            "enabled_artifacts": self.artifacts,
+            "running": self._task is not None and not self._task.done(),
+            "ready": sorted(self.results.keys()),
+            "artifacts": artifacts,
+        }
+
+
+# Global instance
+pregenerator = PreGenerator()
@@ -0,0 +1,185 @@
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Requests slower than this get their full span tree logged
+SLOW_REQUEST_MS = float(os.getenv("TRACE_SLOW_REQUEST_MS", "2000"))
+
+# Upper bound for on-demand profiling runs
+MAX_PROFILE_SECONDS = 60.0
+
+
+class Span:
+    """A timed, named operation with nested child spans"""
+    
+    __slots__ = ("name", "start", "end", "error", "children")
+    
+    def __init__(self, name: str):
+        """Start timing a span"""
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+        self.children: List["Span"] = []
+    
+    @property
+    def duration_ms(self) -> float:
+        """Elapsed time in milliseconds (up to now if still open)"""
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+    
+    def format_tree(self, depth: int = 0) -> str:
+        """Render span tree as indented text with start offsets relative to the root"""
+        lines = []
+        self._format(self.start, depth, lines)
+        return "\n".join(lines)
+    
+    def _format(self, origin: float, depth: int, lines: List[str]):
+        """Append one line per span to lines"""
+        offset_ms = (self.start - origin) * 1000
+        error = f" error={self.error}" if self.error else ""
+        lines.append(f"{'  ' * depth}{self.name} +{offset_ms:.1f}ms {self.duration_ms:.1f}ms{error}")
+        for child in self.children:
+            child._format(origin, depth + 1, lines)
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+
+def get_request_id() -> Optional[str]:
+    """
+    Get the ID of the request being handled in the current context
+    
+    Returns:
+        Request ID, or None outside a traced request
+    """
+    return _request_id.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[Span]:
+    """
+    Record a nested span under the current one
+    
+    Context variables are copied into tasks and worker threads, so spans opened
+    there still attach to the request that started them.
+    
+    Args:
+        name: Span name
+    """
+    current = Span(name)
+    parent = _current_span.get()
+    if parent is not None:
+        parent.children.append(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """
+    Decorator recording each call of a sync or async function as a span
+    
+    Args:
+        name: Span name, defaults to the function's qualified name
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+        
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    
+    return decorator
+
+
+@contextmanager
+def trace_request(name: str, request_id: Optional[str] = None) -> Iterator[Span]:
+    """
+    Trace one request as a root span and log its tree if it was slow
+    
+    Args:
+        name: Root span name, e.g. "POST /generate/summary"
+        request_id: Request ID to use, generated if not given
+    """
+    request_id = request_id or uuid.uuid4().hex
+    id_token = _request_id.set(request_id)
+    span_token = _current_span.set(None)
+    try:
+        with span(name) as root:
+            yield root
+    finally:
+        _current_span.reset(span_token)
+        _request_id.reset(id_token)
+        if root.duration_ms >= SLOW_REQUEST_MS:
+            logger.warning(
+                "Slow request %s (%.1fms > %.0fms):\n%s",
+                request_id, root.duration_ms, SLOW_REQUEST_MS, root.format_tree()
+            )
+
+
+def _frame_label(frame) -> str:
+    """Flamegraph frame label: function (file:line)"""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> str:
+    """
+    Sample the stacks of all threads in this process
+    
+    Blocks the calling thread, so run it off the event loop.
+    
+    Args:
+        seconds: How long to sample for
+        interval: Delay between samples in seconds
+    
+    Returns:
+        Folded stacks ("thread;outer;...;inner count" per line) for flamegraph tools
+    """
+    seconds = min(max(seconds, 0.0), MAX_PROFILE_SECONDS)
+    own_thread = threading.get_ident()
+    counts: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    
+    return "\n".join(f"{stack} {count}" for stack, count in counts.most_common())
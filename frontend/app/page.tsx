@@ -351,6 +351,22 @@ export default function Home() {
                   <div className="flex-1">
                     <div className="text-[#00d9ff] font-bold mb-2">Answer:</div>
                     <div className="text-[#e2e8f0] whitespace-pre-wrap leading-relaxed">{result.answer}</div>
+                    {result.citations && result.citations.length > 0 && (
+                      <div className="mt-4 space-y-2">
+                        <div className="text-[#00d9ff] font-bold">Sources:</div>
+                        {result.citations.map((citation: any) => (
+                          <div key={citation.id} className="border-l-4 border-[#00d9ff] pl-3 text-sm">
+                            <span className="text-[#00ff88] font-bold">[{citation.id}] Page {citation.page}</span>
+                            <div className="text-[#94a3b8] italic">&quot;{citation.text}&quot;</div>
+                          </div>
+                        ))}
+                      </div>
+                    )}
+                    {result.grounded === false && (
+                      <div className="mt-4 text-sm text-[#94a3b8] italic">
+                        No passage matched your question, so this answer has no sources.
+                      </div>
+                    )}
                   </div>
                 </div>
               </div>